@@ -1,22 +1,80 @@
 import asyncio
-import json
+import dataclasses
+import functools
+import hashlib
 import os
 import platform
-import subprocess
+import random
+import re
+import secrets
+import shlex
+import shutil
+import signal
+import sqlite3
 import sys
+import time
+from collections import OrderedDict
 from datetime import datetime
 from typing import List, Literal, Optional
 
-import google.generativeai as genai
-import pytz
+import orjson
 from dotenv import load_dotenv
-from magentic import Agent, Runner, function_tool
-from magentic.chat_models import GeminiChatCompletionsModel
-from pydantic import BaseModel, Field
+from pydantic import ConfigDict, Field, TypeAdapter
+from pydantic.dataclasses import dataclass
+from typing_extensions import Annotated
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Upper bound (in seconds) for a single fanned-out agent call
+AGENT_STEP_TIMEOUT = float(os.getenv("AGENT_STEP_TIMEOUT", "900"))
+
+# Limits on concurrent fanned-out Gemini calls and on retries when the rate-limit quota is exhausted
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "6"))
+GEMINI_MAX_RETRIES = 3
+
+# Semantic cache of agent outputs, keyed exactly by agent, input assets and stage message, and semantically by earlier turns
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", ".semantic_cache.sqlite3")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 60 * 60)))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "256"))
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+class _ChunkBuffer:
+    """
+    Coalesces streamed tokens so they reach stdout in one write per flush interval rather than one per token.
+    Anything else printed to stdout must be preceded by a flush() to keep the output in order.
+    """
+
+    def __init__(self, interval=0.016, max_bytes=64 * 1024):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._buf = bytearray()
+        self._handle = None
+
+    def append(self, text):
+        self._buf += text.encode(sys.stdout.encoding or "utf-8", errors="replace")
+        if len(self._buf) >= self.max_bytes:
+            self.flush()
+        elif self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(self.interval, self.flush)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._buf:
+            return
+        sys.stdout.flush()
+        # Going through the stdout buffer keeps redirected or wrapped streams working and retries partial writes for us
+        sys.stdout.buffer.write(self._buf)
+        sys.stdout.buffer.flush()
+        self._buf.clear()
+
+
+stream_buffer = _ChunkBuffer()
+
+
 def parse_event(event):
     """Parses and prints stream events from the Runner."""
     GREEN = "\033[92m"
@@ -25,8 +83,10 @@ def parse_event(event):
     if event.type == "run_item_stream_event":
         if event.name == "llm_response_chunk":
             # This is streamed final answer tokens from Gemini
-            print(f"{GREEN}{event.item.raw_item}{RESET}", end="", flush=True)
-        elif event.name == "tool_called":
+            stream_buffer.append(f"{GREEN}{event.item.raw_item}{RESET}")
+            return
+        stream_buffer.flush()
+        if event.name == "tool_called":
             print()
             print(f"{GREEN}> Tool Called: {event.item.raw_item.name}{RESET}")
             print(f"{GREEN}> Tool Args: {event.item.raw_item.arguments}{RESET}")
@@ -34,10 +94,15 @@ def parse_event(event):
             print(f"{GREEN}> Tool Output: {event.item.raw_item['output']}{RESET}")
     
     elif event.type == "agent_updated_stream_event":
+        stream_buffer.flush()
         print(f"{GREEN}> Current Agent: {event.new_agent.name}{RESET}")
 
 
-@function_tool
+@functools.lru_cache(maxsize=1)
+def _current_os():
+    return platform.system()
+
+
 def get_current_os():
     """
     Returns the name of the current operating system.
@@ -45,40 +110,340 @@ def get_current_os():
     Returns:
         str: The name of the operating system (e.g., 'Linux', 'Windows', 'Darwin').
     """
-    return platform.system()
+    return _current_os()
+
+
+def _scan_assets(folder="./assets", exclude=()):
+    """
+    Yields (entry, stat) for every file and directory below `folder`, directories before their contents, in name order.
+    Symlinked directories are never followed, so a link to a parent or to / can neither loop nor escape the folder.
+    Directories that cannot be listed and entries that cannot be stat'ed are skipped.
+    `exclude` names subdirectories of `folder` itself to leave out.
+    """
+    try:
+        with os.scandir(folder) as iterator:
+            entries = sorted(iterator, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and entry.name in exclude:
+                continue
+            if not is_dir and not entry.is_file():
+                continue
+            stat = entry.stat(follow_symlinks=not is_dir)
+        except OSError:
+            continue
+        yield entry, stat
+        if is_dir:
+            yield from _scan_assets(entry.path)
+
+
+# Read-only commands whose output only depends on the contents of ./assets.
+# Anything chaining, redirecting or substituting, or naming a path outside ./assets, is never cached.
+_READ_ONLY_COMMAND = re.compile(r"^(ffprobe|ls|file|identify|stat|cat|head|wc)\b[^;&|<>`$\n]*$")
+# Least recently used entries are evicted first; each holds up to MAX_CAPTURE_BYTES of output
+CMD_CACHE_MAX_ENTRIES = 128
+_cmd_cache = OrderedDict()
+
+
+def _paths_state(paths):
+    """
+    Returns the sizes and modification times of the named paths and, for directories, of everything below them.
+    Raises OSError if a path cannot be stat'ed.
+    """
+    state = []
+    for path in paths:
+        stat = os.stat(path)
+        state.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        if os.path.isdir(path):
+            state.extend(f"{entry.path}:{child.st_size}:{child.st_mtime_ns}" for entry, child in _scan_assets(path))
+    return "\n".join(state)
+
+
+def _inside_assets(path, folder="./assets"):
+    if path.startswith("~"):
+        return False
+    assets = os.path.realpath(folder)
+    resolved = os.path.realpath(path)
+    return resolved == assets or resolved.startswith(assets + os.sep)
+
+
+def _command_cache_key(command):
+    """Returns the cache key of a read-only command over ./assets, or None if its output must not be cached."""
+    if not _READ_ONLY_COMMAND.match(command.strip()):
+        return None
+    try:
+        arguments = shlex.split(command)[1:]
+    except ValueError:
+        return None
+    # Anything that looks like a path must be inside ./assets, and there must be at least one (a bare `ls` lists the cwd)
+    paths = [argument for argument in arguments if not argument.startswith("-") and ("/" in argument or os.sep in argument or os.path.exists(argument))]
+    if not paths or not all(_inside_assets(path) for path in paths):
+        return None
+    # Only the named paths are stat'ed, so keying a command costs far less than the process it saves
+    try:
+        state = _paths_state(paths)
+    except OSError:
+        return None
+    return hashlib.blake2b(f"{state}\n{command}".encode()).digest()
+
+
+MAX_CAPTURE_BYTES = 64 * 1024
+
+
+async def collect_bounded(stream, max_bytes=MAX_CAPTURE_BYTES):
+    """
+    Reads a subprocess pipe to the end while keeping only its first and last max_bytes / 2 bytes.
+    Returns the kept text (with a marker where bytes were dropped) and the total number of bytes read.
+    """
+    half = max_bytes // 2
+    head = bytearray()
+    tail = bytearray()
+    total = 0
+    while chunk := await stream.read(64 * 1024):
+        total += len(chunk)
+        view = memoryview(chunk)
+        if len(head) < half:
+            taken = half - len(head)
+            head += view[:taken]
+            view = view[taken:]
+        tail += view
+        if len(tail) > half:
+            del tail[:len(tail) - half]
+    text = head.decode(errors="replace")
+    dropped = total - len(head) - len(tail)
+    if dropped:
+        text += f"\n... [{dropped} bytes truncated] ...\n"
+    return text + tail.decode(errors="replace"), total
+
+
+def _kill_process_tree(process):
+    """Kills a shell started by _run_shell together with every command it spawned."""
+    if os.name == "posix":
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+
+async def _run_shell(command):
+    """Runs a command in the system's shell and returns its bounded output and exit code."""
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=os.name == "posix"
+    )
+    try:
+        (stdout, stdout_bytes), (stderr, stderr_bytes) = await asyncio.gather(
+            collect_bounded(process.stdout),
+            collect_bounded(process.stderr)
+        )
+        await process.wait()
+    except asyncio.CancelledError:
+        # A timed-out or cancelled step must not leave ffmpeg running and writing into ./assets
+        _kill_process_tree(process)
+        await process.wait()
+        raise
+    return {
+        "stdout": stdout,
+        "stdout_bytes": stdout_bytes,
+        "stderr": stderr,
+        "stderr_bytes": stderr_bytes,
+        "return_code": process.returncode
+    }
 
 
-@function_tool
-def execute_terminal_command(command: str):
+async def execute_terminal_command(command: str):
     """
-    Executes a terminal command string using the system's shell.
+    Executes a terminal command string using the system's shell without blocking the event loop.
 
     Args:
         command: The command string to execute (e.g., "ls -l", "grep 'pattern' file.txt").
                  NOTE: Using shell=True can be a security risk with untrusted input.
 
     Returns:
-        A JSON string containing {"stdout": str, "stderr": str, "return_code": int}.
+        A JSON string containing {"stdout": str, "stdout_bytes": int, "stderr": str, "stderr_bytes": int, "return_code": int}.
+        Output longer than 64 KB keeps only its first and last 32 KB; the *_bytes fields give the full size.
     """
     try:
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True
-        )
-        return json.dumps({"stdout": result.stdout, "stderr": result.stderr, "return_code": result.returncode})
+        cache_key = _command_cache_key(command)
+        if cache_key in _cmd_cache:
+            _cmd_cache.move_to_end(cache_key)
+            return _cmd_cache[cache_key]
+        result = await _run_shell(command)
+        output = orjson.dumps(result).decode()
+        if cache_key is not None and result["return_code"] == 0:
+            _cmd_cache[cache_key] = output
+            if len(_cmd_cache) > CMD_CACHE_MAX_ENTRIES:
+                _cmd_cache.popitem(last=False)
+        return output
     except FileNotFoundError:
         error_msg = f"Error: The shell or command '{command.split()[0] if command else ''}' was not found."
         print(error_msg, file=sys.stderr)
-        return json.dumps({"stdout": "", "stderr": error_msg, "return_code": 127})
+        return orjson.dumps({"stdout": "", "stderr": error_msg, "return_code": 127}).decode()
     except Exception as e:
         error_msg = f"An unexpected error occurred while executing '{command}': {e}"
         print(error_msg, file=sys.stderr)
-        return json.dumps({"stdout": "", "stderr": error_msg, "return_code": -1})
+        return orjson.dumps({"stdout": "", "stderr": error_msg, "return_code": -1}).decode()
+
+
+def _split_on_boundaries(text, pattern):
+    """
+    Splits batched output on boundary markers into {command index: (output, captured group)}
+    and the trailing output after the last marker, which belongs to the command that ended the shell.
+    """
+    parts = re.split(pattern, text)
+    return {int(index): (output, group) for output, index, group in zip(parts[0::3], parts[1::3], parts[2::3])}, parts[-1]
+
 
+async def execute_terminal_commands(commands: List[str], stop_on_error: bool = True):
+    """
+    Executes several terminal commands, in order, in a single POSIX shell invocation.
 
-class RequirementAnalysis(BaseModel):
+    Args:
+        commands: The command strings to execute one after another.
+        stop_on_error: If true, stop at the first command that exits with a non-zero return code.
+
+    Returns:
+        A JSON string containing {"results": [{"command": str, "stdout": str, "stderr": str, "return_code": int}],
+        "stdout_bytes": int, "stderr_bytes": int, "return_code": int}.
+        Commands skipped after a failure are not listed. A command that ended the shell (exit, exec, a syntax
+        error) is listed with the shell's return code. Output is bounded as in execute_terminal_command,
+        so commands whose boundaries fell in a truncated region are listed with a null return_code.
+    """
+    marker = f"---CMD_BOUNDARY_{secrets.token_hex(4)}_"
+    lines = []
+    for index, command in enumerate(commands):
+        lines.append(command)
+        lines.append(f'__rc=$?; echo "{marker}{index}:$__rc"; echo "{marker}{index}:" >&2')
+        if stop_on_error:
+            lines.append('[ "$__rc" -eq 0 ] || exit "$__rc"')
+
+    try:
+        result = await _run_shell("\n".join(lines))
+    except Exception as e:
+        error_msg = f"An unexpected error occurred while executing the batched commands: {e}"
+        print(error_msg, file=sys.stderr)
+        return orjson.dumps({"results": [], "stdout_bytes": 0, "stderr_bytes": 0, "return_code": -1, "stderr": error_msg}).decode()
+
+    pattern = re.escape(marker) + r"(\d+):(-?\d*)\n"
+    stdout_parts, stdout_tail = _split_on_boundaries(result["stdout"], pattern)
+    stderr_parts, stderr_tail = _split_on_boundaries(result["stderr"], pattern)
+    last_index = max(stdout_parts, default=-1)
+    results = []
+    for index, command in enumerate(commands[:last_index + 1]):
+        stdout, return_code = stdout_parts.get(index, ("", ""))
+        stderr, _ = stderr_parts.get(index, ("", ""))
+        results.append({
+            "command": command,
+            "stdout": stdout,
+            "stderr": stderr,
+            "return_code": int(return_code) if return_code else None
+        })
+
+    # A command that exits, execs, is killed or does not parse ends the shell before its marker is printed.
+    # Its output is whatever follows the last marker, and the shell's return code is its own.
+    stopped_on_error = stop_on_error and results and results[-1]["return_code"] not in (0, None)
+    if last_index + 1 < len(commands) and (stdout_tail or stderr_tail or not stopped_on_error):
+        results.append({
+            "command": commands[last_index + 1],
+            "stdout": stdout_tail,
+            "stderr": stderr_tail,
+            "return_code": result["return_code"]
+        })
+    return orjson.dumps({
+        "results": results,
+        "stdout_bytes": result["stdout_bytes"],
+        "stderr_bytes": result["stderr_bytes"],
+        "return_code": result["return_code"]
+    }).decode()
+
+
+MEDIA_EXTENSIONS = {
+    ".mp4", ".mov", ".mkv", ".avi", ".webm", ".mxf", ".m4v",
+    ".wav", ".mp3", ".aac", ".m4a", ".flac",
+    ".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp"
+}
+TEXT_EXTENSIONS = {".txt", ".md", ".csv", ".json"}
+MAX_MANIFEST_TEXT_BYTES = 16 * 1024
+MANIFEST_TOOLS = ("ffmpeg", "ffprobe", "magick", "convert", "identify")
+_probe_cache = {}
+
+
+async def probe_asset(path, stat):
+    """Returns the ffprobe metadata of a media file, reusing earlier results for unchanged files."""
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _probe_cache:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            stdout, _ = await process.communicate()
+            _probe_cache[key] = orjson.loads(stdout) if process.returncode == 0 and stdout else None
+        except (OSError, orjson.JSONDecodeError):
+            _probe_cache[key] = None
+    return _probe_cache[key]
+
+
+async def build_asset_manifest(folder="./assets"):
+    """
+    Describes every file under `folder` in one pass: its size, ffprobe metadata for media files
+    and the contents of small text files such as the requirements document.
+    Also records the operating system and which media tools are installed.
+    """
+    # One ffprobe per core at most, so a large assets folder cannot exhaust processes or file descriptors
+    probe_slots = asyncio.Semaphore(os.cpu_count() or 4)
+
+    async def describe(entry, stat):
+        try:
+            extension = os.path.splitext(entry.name)[1].lower()
+            item = {"path": entry.path, "size": stat.st_size}
+            if extension in MEDIA_EXTENSIONS:
+                async with probe_slots:
+                    item["ffprobe"] = await probe_asset(entry.path, stat)
+            elif extension in TEXT_EXTENSIONS and stat.st_size <= MAX_MANIFEST_TEXT_BYTES:
+                with open(entry.path, encoding="utf-8", errors="replace") as file:
+                    item["contents"] = file.read()
+        except OSError:
+            # The file vanished or became unreadable after the scan
+            return None
+        return item
+
+    entries = [(entry, stat) for entry, stat in _scan_assets(folder) if not entry.is_dir(follow_symlinks=False)]
+    files = [item for item in await asyncio.gather(*(describe(entry, stat) for entry, stat in entries)) if item is not None]
+    return {
+        "operating_system": _current_os(),
+        "available_tools": {tool: shutil.which(tool) is not None for tool in MANIFEST_TOOLS},
+        "files": files
+    }
+
+
+MANIFEST_PREFIX = "CONTEXT_MANIFEST:\n"
+
+
+def manifest_message(manifest):
+    """Wraps an asset manifest as a context message for the agents."""
+    return {'role': 'user', 'content': MANIFEST_PREFIX + orjson.dumps(manifest).decode()}
+
+
+# Structured agent outputs are pydantic dataclasses validated through TypeAdapters built once at import time
+OUTPUT_CONFIG = ConfigDict(extra="ignore", defer_build=False)
+
+@dataclass(config=OUTPUT_CONFIG)
+class ClientRequirements:
+    requirements: Annotated[List[str], Field(description="Each individual client requirement, verbatim and in document order.")]
+    any_user_input_required: bool
+    question_to_user: Annotated[Optional[str], Field(description="Ask additional inputs from the user if needed or if the requirements cannot be found.")]
+
+@dataclass(config=OUTPUT_CONFIG)
+class RequirementAnalysis:
     requirement_number: int
     requirement_specification: str
     relevant_available_files: List[str]
@@ -87,25 +452,30 @@ class RequirementAnalysis(BaseModel):
     plan_of_action: Optional[str]
     reasoning: str
 
-class AllRequirementsAnalysis(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class AllRequirementsAnalysis:
     all_requirements_analysis: List[RequirementAnalysis]
     can_satisfy_all_requirements: bool
     any_user_input_required: bool
-    question_to_user: Optional[str] = Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")
+    question_to_user: Annotated[Optional[str], Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")]
 
-class PlannerStep(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class PlannerStep:
     step_number: int
     description: str
     terminal_command: str
     reasoning: str
+    parallel_group: Annotated[Optional[int], Field(description="Steps sharing a group number do not depend on each other and can run at the same time.")]
 
-class AllPlannerSteps(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class AllPlannerSteps:
     all_planner_steps: List[PlannerStep]
     can_satisfy_all_requirements: bool
     any_user_input_required: bool
-    question_to_user: Optional[str] = Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")
+    question_to_user: Annotated[Optional[str], Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")]
 
-class ExecutorStep(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class ExecutorStep:
     step_number: int
     terminal_command: str
     execution_status: Literal["Success", "Failure"]
@@ -113,33 +483,210 @@ class ExecutorStep(BaseModel):
     updated_command: Optional[str]
     challenges_faced: Optional[str]
 
-class AllExecutorSteps(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class AllExecutorSteps:
     all_executor_steps: List[ExecutorStep]
     can_satisfy_all_requirements: bool
     any_user_input_required: bool
-    question_to_user: Optional[str] = Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")
+    question_to_user: Annotated[Optional[str], Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")]
 
-class QCStep(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class QCStep:
     requirement_number: int
     requirement_specification: str
     relevant_available_files: List[str]
     requirement_satisfied_successfully: bool
     reasoning: str
 
-class AllQCSteps(BaseModel):
+@dataclass(config=OUTPUT_CONFIG)
+class AllQCSteps:
     all_qc_steps: List[QCStep]
     all_requirements_satisfied: bool
     any_user_input_required: bool
-    question_to_user: Optional[str] = Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")
+    question_to_user: Annotated[Optional[str], Field(description="Ask additional inputs from the user if needed or if all requirements cannot be satisfied.")]
+
+OUTPUT_ADAPTERS = {
+    output_type: TypeAdapter(output_type)
+    for output_type in (ClientRequirements, AllRequirementsAnalysis, AllPlannerSteps, AllExecutorSteps, AllQCSteps)
+}
+
+# JSON schemas are compile-time constants of the output types, so they are generated once here
+SCHEMAS = {output_type: adapter.json_schema() for output_type, adapter in OUTPUT_ADAPTERS.items()}
+
+
+_GEMINI_SCHEMA_KEYS = {"type", "format", "description", "nullable", "enum", "properties", "required", "items"}
+
+
+def gemini_response_schema(schema):
+    """
+    Converts a pydantic JSON schema into the OpenAPI subset accepted by Gemini's response_schema:
+    $refs are inlined, Optional[...] becomes nullable and unsupported keywords are dropped.
+    """
+    definitions = schema.get("$defs", {})
+
+    def convert(node):
+        if "$ref" in node:
+            converted = convert(definitions[node["$ref"].rsplit("/", 1)[-1]])
+            if "description" in node:
+                converted["description"] = node["description"]
+            return converted
+        if "anyOf" in node:
+            options = [option for option in node["anyOf"] if option.get("type") != "null"]
+            converted = convert(options[0])
+            if len(options) < len(node["anyOf"]):
+                converted["nullable"] = True
+            if "description" in node:
+                converted["description"] = node["description"]
+            return converted
+        converted = {key: value for key, value in node.items() if key in _GEMINI_SCHEMA_KEYS}
+        if "properties" in converted:
+            converted["properties"] = {name: convert(value) for name, value in converted["properties"].items()}
+        if "items" in converted:
+            converted["items"] = convert(converted["items"])
+        return converted
 
+    return convert(schema)
 
-# Configure the Google Gemini API client
-try:
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-except Exception as e:
-    print(f"Error configuring Gemini API: {e}\nPlease ensure your GEMINI_API_KEY is set in the .env file.")
-    sys.exit(1)
 
+@functools.lru_cache(maxsize=None)
+def json_mode_config(output_type):
+    """
+    Returns a Gemini generation_config that constrains decoding to the output type's schema.
+    Gemini does not allow JSON mode together with function calling, so it only suits agents without tools.
+    The result is cached and shared between calls, so it must not be modified.
+    """
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": gemini_response_schema(SCHEMAS[output_type])
+    }
+
+
+def serialize_output(output, indent=None):
+    """Serializes a structured agent output to a JSON string."""
+    return OUTPUT_ADAPTERS[type(output)].dump_json(output, indent=indent).decode()
+
+
+class SemanticCache:
+    """
+    A small sqlite-backed cache of agent outputs.
+    Entries are grouped by namespace and matched by cosine similarity of their (unit-length) embeddings,
+    or by namespace alone when they are stored without an embedding.
+    Entries older than `ttl` seconds are evicted, and at most `max_number_of_cache` of the newest are kept.
+    """
+
+    def __init__(self, path, ttl, max_number_of_cache):
+        self.ttl = ttl
+        self.max_number_of_cache = max_number_of_cache
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "output TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace)")
+        self.evict()
+
+    def lookup(self, namespace, embedding=None, threshold=1.0):
+        """
+        Returns the stored output most similar to `embedding`, or None if nothing reaches `threshold`.
+        Without an embedding, returns the newest output stored without one under `namespace`.
+        """
+        if embedding is None:
+            row = self.connection.execute(
+                "SELECT output FROM entries WHERE namespace = ? AND created_at >= ? AND length(embedding) = 0 "
+                "ORDER BY created_at DESC LIMIT 1",
+                (namespace, time.time() - self.ttl)
+            ).fetchone()
+            return row[0] if row else None
+        rows = self.connection.execute(
+            "SELECT embedding, output FROM entries WHERE namespace = ? AND created_at >= ? AND length(embedding) > 0",
+            (namespace, time.time() - self.ttl)
+        ).fetchall()
+        if not rows:
+            return None
+        import numpy as np
+        index = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+        scores = index @ embedding
+        best = int(np.argmax(scores))
+        return rows[best][1] if scores[best] >= threshold else None
+
+    def put(self, namespace, output, embedding=None):
+        if embedding is None:
+            blob = b""
+        else:
+            import numpy as np
+            blob = embedding.astype(np.float32).tobytes()
+        self.connection.execute(
+            "INSERT INTO entries (namespace, embedding, output, created_at) VALUES (?, ?, ?, ?)",
+            (namespace, blob, output, time.time())
+        )
+        self.evict()
+
+    def evict(self):
+        self.connection.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,))
+        self.connection.execute(
+            "DELETE FROM entries WHERE id NOT IN (SELECT id FROM entries ORDER BY created_at DESC LIMIT ?)",
+            (self.max_number_of_cache,)
+        )
+        self.connection.commit()
+
+
+class CachedRunResult:
+    """Stands in for a Runner result when the agent's output is served from the semantic cache."""
+
+    def __init__(self, agent, messages, output):
+        self.last_agent = agent
+        self.final_output = OUTPUT_ADAPTERS[agent.output_type].validate_json(output)
+        self._input_list = messages + [{'role': 'assistant', 'content': output}]
+
+    def to_input_list(self):
+        return list(self._input_list)
+
+
+def assets_fingerprint(folder="./assets"):
+    """
+    Returns a digest of the names, sizes and modification times of the input files under `folder`.
+    The temp folder is left out: every run writes its intermediate and delivered files there, and including
+    them would make each run miss the entries of the previous one.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for entry, stat in _scan_assets(folder, exclude=("temp",)):
+        if not entry.is_dir(follow_symlinks=False):
+            digest.update(f"{entry.path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+async def embed_messages(messages):
+    """
+    Embeds the serialized messages and returns a unit-length vector.
+    Manifest messages are left out: the assets are already matched exactly through the cache namespace,
+    and a large manifest would push the rest of the conversation past the embedding model's input limit.
+    """
+    import google.generativeai as genai
+    import numpy as np
+
+    content = [message for message in messages if not str(message.get("content", "")).startswith(MANIFEST_PREFIX)]
+    response = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        genai.embed_content,
+        model=EMBEDDING_MODEL,
+        content=orjson.dumps(content, default=str).decode(),
+        task_type="semantic_similarity"
+    ))
+    embedding = np.asarray(response["embedding"], dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
+
+@functools.lru_cache(maxsize=1)
+def get_semantic_cache():
+    """Opens the semantic cache on first use, so runs that exit early never touch the database."""
+    return SemanticCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES)
+
+
+READER_INSTRUCTIONS = """
+You are a meticulous document reader.
+Your only goal is to locate the client's requirements document and list every individual requirement it contains, exactly as written.
+Do not analyse, plan or judge the requirements.
+"""
 
 ANALYZER_INSTRUCTIONS = """
 Your goal is to thoroughly understand the client requirements and decide if they can be achieved or not with the available input files.
@@ -164,96 +711,56 @@ Thoroughly understand the client requirements, compare it available files and ch
 You will raise a flag if you find that the client's expectations are not successfully met.
 """
 
-# Define the Gemini model to be used by the agents
-gemini_model = GeminiChatCompletionsModel("gemini-1.5-flash-latest")
-
-analyzer_agent = Agent(
-    name="Client Requirements Analyst",
-    instructions=ANALYZER_INSTRUCTIONS,
-    model=gemini_model,
-    tools=[get_current_os, execute_terminal_command],
-    output_type=AllRequirementsAnalysis
-)
-
-planner_agent = Agent(
-    name="Senior Media Post-Production Task Planner",
-    instructions=PLANNER_INSTRUCTIONS,
-    model=gemini_model,
-    tools=[get_current_os, execute_terminal_command],
-    output_type=AllPlannerSteps
-)
-
-executor_agent = Agent(
-    name="Senior Media Post-Production Client Delivery Expert",
-    instructions=EXECUTOR_INSTRUCTIONS,
-    model=gemini_model,
-    tools=[get_current_os, execute_terminal_command],
-    output_type=AllExecutorSteps
-)
-
-qc_agent = Agent(
-    name="Senior Media Post-Production Quality Checker",
-    instructions=QC_INSTRUCTIONS,
-    model=gemini_model,
-    tools=[get_current_os, execute_terminal_command],
-    output_type=AllQCSteps
-)
-
-
-async def process_step(agent, messages):
-    """Runs an agent, streams the output, and handles user interaction."""
-    while True:
-        result = Runner.run_streamed(agent, messages)
-
-        async for event in result.stream_events():
-            parse_event(event)
-
-        if result.final_output.any_user_input_required:
-            print(f"\n{result.last_agent.name} >> {result.final_output.question_to_user}")
-            user_input = input("User Response >> ")
-            messages = result.to_input_list()
-            messages.append({'role': 'user', 'content': user_input})
-        else:
-            break
-    
-    # Add a newline for cleaner separation between steps
-    print("\n")
-    return result
+REQUIREMENTS_PROMPT = """
+OVERALL WORKFLOW: Analysis (We are here now) --> Task Planning --> Execution --> Quality Check
+INSTRUCTIONS:
+Find the client's requirements document and list every individual requirement in it.
+Keep the wording of each requirement exactly as written and preserve the order of the document.
 
+AVAILABLE TOOLS: You can use terminal commands to list and read files.
+WORKING FOLDER: ./assets (All input files and requirements are in this folder)
+ASSET MANIFEST: CONTEXT_MANIFEST lists the files in the working folder with their metadata. Use it instead of listing or probing them again.
+IMPORTANT: Do not perform any actions or modify any files.
+ASK QUESTIONS: If you cannot find the requirements, please ask.
+"""
 
-async def main():
-    ANALYZER_PROMPT = """
+ANALYZER_PROMPT = """
 OVERALL WORKFLOW: Analysis (We are here now) --> Task Planning --> Execution --> Quality Check
 INSTRUCTIONS:
 We need to deliver the media package as per the specifications mentioned in the client's requirements document.
 Analyse the client requirements thoroughly and compare it to the available input files.
 Decide if it is possible to achieve the expectations using the available input files and tools.
 
-AVAILABLE TOOLS: You can use FFMPEG, FFPROBE, ImageMagick and other terminal commands as required.
+AVAILABLE TOOLS: Later steps can use FFMPEG, FFPROBE, ImageMagick and other terminal commands. CONTEXT_MANIFEST shows which are installed.
 WORKING FOLDER: ./assets (All input files and requirements are in this folder)
+ASSET MANIFEST: CONTEXT_MANIFEST lists the files in the working folder with their metadata. Base your analysis on it.
 IMPORTANT: You are only an analyst. Do not perform any actions or modify any files.
 ASK QUESTIONS: If you need user input, please ask.
 """
 
-    PLANNER_PROMPT = """
+PLANNER_PROMPT = """
 OVERALL WORKFLOW: Analysis --> Task Planning (We are here now) --> Execution --> Quality Check
 INSTRUCTIONS:
 Create a detailed step-by-step plan to achieve the desired output based on the previous analysis.
 All tasks like transformation, extraction, renaming etc should be done in a separate sub-directory called 'temp'.
 The 'temp' folder should be created in the './assets' folder. Creating this sub-directory should be the first step if it doesn't exist.
 Each terminal command should be complete and self-contained.
+Give steps that do not depend on each other (e.g. the same operation on different files) the same parallel_group number.
 
-CONTEXT: The output of the previous 'Analysis' step is attached above.
-AVAILABLE TOOLS: You can use FFMPEG, FFPROBE, ImageMagick and other terminal commands.
+CONTEXT: The output of the previous 'Analysis' step is attached.
+AVAILABLE TOOLS: The plan can use FFMPEG, FFPROBE, ImageMagick and other terminal commands. CONTEXT_MANIFEST shows which are installed and the operating system.
 WORKING FOLDER: ./assets
+ASSET MANIFEST: CONTEXT_MANIFEST lists the files in the working folder with their metadata. Base your plan on it.
 IMPORTANT: You are only a task planner. The actual execution will be performed later.
 """
 
-    EXECUTOR_PROMPT = """
+EXECUTOR_PROMPT = """
 OVERALL WORKFLOW: Analysis --> Task Planning --> Execution (We are here now) --> Quality Check
 INSTRUCTIONS:
 You have been provided with a step-by-step plan. Execute the plan and record your observations.
 If any step fails, analyse the reason, make necessary modifications to the command if needed, and try again until it succeeds.
+Steps that share a parallel_group can be executed at the same time: issue their terminal commands together as simultaneous tool calls.
+Consecutive steps that depend on each other can be run together with execute_terminal_commands, when that tool is available, to save round trips.
 
 CONTEXT: The output of the previous 'Analysis' and 'Task Planning' steps are attached.
 AVAILABLE TOOLS: You can use FFMPEG, FFPROBE, ImageMagick and other terminal commands.
@@ -261,7 +768,7 @@ WORKING FOLDER: ./assets
 IMPORTANT: Keep task executions safe and localized to the working folder.
 """
 
-    QC_PROMPT = """
+QC_PROMPT = """
 OVERALL WORKFLOW: Analysis --> Task Planning --> Execution --> Quality Check (We are here now)
 INSTRUCTIONS:
 Check if the available files (input files and generated files in the temp folder) satisfy the client's requirements.
@@ -270,46 +777,416 @@ You are allowed to make minor modifications if needed (like renaming files or cl
 CONTEXT: The outputs of 'Analysis', 'Task Planning' and 'Execution' are attached.
 AVAILABLE TOOLS: You can use FFMPEG, FFPROBE, ImageMagick and other terminal commands.
 WORKING FOLDER: ./assets
+ASSET MANIFEST: CONTEXT_MANIFEST lists the files in the working folder (including the temp folder) with their metadata. Use it instead of listing or probing them again.
 IMPORTANT: Keep task executions safe and localized to the working folder.
 """
 
-    messages = [{'role': 'user', 'content': ANALYZER_PROMPT}]
+GEMINI_MODEL = "gemini-1.5-flash-latest"
+
+
+def stage_message(prompt, context=""):
+    """Builds the user turn that starts a stage: the static stage prompt first, then the dynamic context."""
+    return {'role': 'user', 'content': prompt + context}
+
+
+def build_agents(http_client):
+    """Builds the workflow's agents on one shared Gemini model."""
+    from magentic import Agent, function_tool
+    from magentic.chat_models import GeminiChatCompletionsModel
+
+    # Define the Gemini model to be used by the agents
+    gemini_model = GeminiChatCompletionsModel(GEMINI_MODEL, http_client=http_client)
+
+    read_tools = [function_tool(get_current_os), function_tool(execute_terminal_command)]
+    execution_tools = list(read_tools)
+    if os.name == "posix":
+        # The batched script relies on POSIX shell syntax ($?, [ ], exit), which cmd.exe does not understand
+        execution_tools.append(function_tool(execute_terminal_commands))
+
+    reader_agent = Agent(
+        name="Client Requirements Reader",
+        instructions=READER_INSTRUCTIONS,
+        model=gemini_model,
+        tools=read_tools,
+        output_type=ClientRequirements
+    )
+
+    analyzer_agent = Agent(
+        name="Client Requirements Analyst",
+        instructions=ANALYZER_INSTRUCTIONS,
+        model=gemini_model,
+        generation_config=json_mode_config(AllRequirementsAnalysis),
+        output_type=AllRequirementsAnalysis
+    )
+
+    planner_agent = Agent(
+        name="Senior Media Post-Production Task Planner",
+        instructions=PLANNER_INSTRUCTIONS,
+        model=gemini_model,
+        generation_config=json_mode_config(AllPlannerSteps),
+        output_type=AllPlannerSteps
+    )
+
+    executor_agent = Agent(
+        name="Senior Media Post-Production Client Delivery Expert",
+        instructions=EXECUTOR_INSTRUCTIONS,
+        model=gemini_model,
+        tools=execution_tools,
+        output_type=AllExecutorSteps
+    )
+
+    qc_agent = Agent(
+        name="Senior Media Post-Production Quality Checker",
+        instructions=QC_INSTRUCTIONS,
+        model=gemini_model,
+        tools=execution_tools,
+        output_type=AllQCSteps
+    )
+
+    return reader_agent, analyzer_agent, planner_agent, executor_agent, qc_agent
+
+
+@functools.lru_cache(maxsize=1)
+def _user_input_lock():
+    # Created on first use so it belongs to the running event loop
+    return asyncio.Lock()
+
+
+class StepTimeout(Exception):
+    """Raised when a single model call of an agent takes longer than its time limit."""
+
+
+async def _run_agent(agent, messages, stream, timeout):
+    """
+    Runs the agent once over `messages`, printing its events when `stream` is set.
+    Raises StepTimeout if the run takes longer than `timeout` seconds; errors raised by the run itself,
+    including its own timeouts, propagate unchanged.
+    """
+    from magentic import Runner
+
+    async def run():
+        result = Runner.run_streamed(agent, messages)
+        async for event in result.stream_events():
+            if stream:
+                parse_event(event)
+        return result
+
+    task = asyncio.ensure_future(run())
+    try:
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        stream_buffer.flush()
+    if not done:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise StepTimeout(f"{agent.name} did not answer within {timeout:.0f}s")
+    return task.result()
+
+
+async def process_step(agent, messages, use_cache=False, stream=True, timeout=None):
+    """
+    Runs an agent, streams the output, and handles user interaction.
+    With `use_cache`, a semantically similar earlier run of the same agent is reused instead. The agent, the input assets
+    and the final (stage or per-requirement) message must match exactly; only earlier turns are compared semantically,
+    and a step with no earlier turns besides the manifest is looked up by that exact key without an embedding call.
+    Only agents without side effects should be cached.
+    Concurrent steps pass stream=False so their tokens are not interleaved on the terminal.
+    `timeout` bounds each model call, not the time the user takes to answer a follow-up question.
+    """
+    namespace = embedding = None
+    if use_cache:
+        try:
+            namespace = f"{agent.name}:{assets_fingerprint()}:{_short_hash(messages[-1])}"
+            if any(not str(message.get("content", "")).startswith(MANIFEST_PREFIX) for message in messages[:-1]):
+                embedding = await embed_messages(messages)
+            cached_output = get_semantic_cache().lookup(namespace, embedding, SEMANTIC_CACHE_THRESHOLD)
+        except Exception as e:
+            print(f"Semantic cache unavailable: {e}", file=sys.stderr)
+            namespace = embedding = cached_output = None
+        if cached_output is not None:
+            print(f"> {agent.name}: reusing cached output\n")
+            return CachedRunResult(agent, messages, cached_output)
+
+    while True:
+        result = await _run_agent(agent, messages, stream, timeout)
+
+        if result.final_output.any_user_input_required:
+            # One question at a time, read off the event loop so concurrent steps keep running
+            async with _user_input_lock():
+                print(f"\n{result.last_agent.name} >> {result.final_output.question_to_user}")
+                user_input = await asyncio.get_running_loop().run_in_executor(None, input, "User Response >> ")
+            messages = result.to_input_list()
+            messages.append({'role': 'user', 'content': user_input})
+        else:
+            break
+    
+    # Add a newline for cleaner separation between steps
+    print("\n")
+    if namespace is not None:
+        get_semantic_cache().put(namespace, serialize_output(result.final_output), embedding)
+    return result
+
+
+@functools.lru_cache(maxsize=1)
+def _gemini_semaphore():
+    # Created on first use so it belongs to the running event loop
+    return asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+
+def _rate_limit_error(error):
+    """Returns the HTTP 429 error behind `error`, following its cause chain, or None if it is not a rate limit."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        if status == 429:
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _retry_delay(error, attempt):
+    """Returns how long to wait before retrying a rate-limited call, preferring the delay Gemini asks for."""
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after) + random.uniform(0, 1)
+        except ValueError:
+            pass
+    # Gemini reports the delay in the RetryInfo detail of the error body, e.g. "retryDelay": "37s"
+    try:
+        body = response.text if response is not None else str(getattr(error, "body", None) or error)
+    except Exception:
+        body = str(error)
+    match = re.search(r'"?retryDelay"?\s*[:=]\s*"?(\d+(?:\.\d+)?)s', body)
+    if match:
+        return float(match.group(1)) + random.uniform(0, 1)
+    return 2 ** attempt + random.uniform(0, 1)
+
+
+async def process_bounded_step(agent, messages, use_cache=False, stream=True):
+    """
+    Runs a fanned-out step while holding one of GEMINI_MAX_CONCURRENCY slots.
+    When Gemini answers with HTTP 429 the slot is released, and the step is retried after the requested delay.
+    A step whose model call exceeds AGENT_STEP_TIMEOUT is abandoned and returns None, so its siblings can still finish.
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        try:
+            async with _gemini_semaphore():
+                return await process_step(agent, messages, use_cache, stream, timeout=AGENT_STEP_TIMEOUT)
+        except StepTimeout as e:
+            print(f"{e}, skipping this step", file=sys.stderr)
+            return None
+        except Exception as e:
+            rate_limit = _rate_limit_error(e)
+            if rate_limit is None or attempt == GEMINI_MAX_RETRIES:
+                raise
+            delay = _retry_delay(rate_limit, attempt)
+            print(f"{agent.name}: Gemini rate limit reached, retrying in {delay:.1f}s", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+
+async def process_parallel_steps(agent, messages_list, use_cache=False):
+    """
+    Runs one agent over several independent conversations concurrently, without streaming their tokens.
+    Steps that timed out are returned as None. If any step fails, the others are cancelled before the error propagates.
+    """
+    tasks = [asyncio.ensure_future(process_bounded_step(agent, messages, use_cache, stream=False)) for messages in messages_list]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def requirement_message(prompt, number, requirement):
+    """Scopes a stage prompt to a single client requirement."""
+    return stage_message(prompt, f"\nSCOPE: Only consider the following requirement.\nRequirement {number}: {requirement}\n")
+
+
+COMPACTED_OUTPUT_PREFIX = "[compacted tool output] "
+
+
+def _short_hash(text):
+    return hashlib.blake2b(str(text).encode(), digest_size=8).hexdigest()
+
 
-    # STEP 1: Analysis
+def compact_messages(messages, keep_last_n_tool_calls=3):
+    """
+    Replaces the output of all but the last `keep_last_n_tool_calls` tool calls with a short stub
+    recording the tool, hashes of its arguments and output, and the output size.
+    Every other message (prompts, answers, structured outputs and the tool calls themselves) is kept verbatim and in place.
+    """
+    calls = {item["call_id"]: item for item in messages if item.get("type") == "function_call"}
+    outputs = [index for index, item in enumerate(messages) if item.get("type") == "function_call_output"]
+    stale = outputs[:max(0, len(outputs) - keep_last_n_tool_calls)]
+
+    compacted = list(messages)
+    for index in stale:
+        item = messages[index]
+        output = str(item.get("output", ""))
+        if output.startswith(COMPACTED_OUTPUT_PREFIX):
+            continue
+        call = calls.get(item.get("call_id"), {})
+        stub = {
+            "tool": call.get("name"),
+            "args_hash": _short_hash(call.get("arguments", "")),
+            "output_hash": _short_hash(output),
+            "size": len(output)
+        }
+        compacted[index] = {**item, "output": COMPACTED_OUTPUT_PREFIX + orjson.dumps(stub).decode()}
+    return compacted
+
+
+def stream_dump(output):
+    """
+    Yields an agent's structured output as JSON one top-level field at a time,
+    so no single buffer ever holds the whole document.
+    """
+    yield b"{"
+    for index, field in enumerate(dataclasses.fields(output)):
+        separator = b",\n  " if index else b"\n  "
+        yield separator + orjson.dumps(field.name) + b": " + orjson.dumps(getattr(output, field.name))
+    yield b"\n}\n"
+
+
+def print_output(output, keep=False):
+    """
+    Streams an agent's structured output to stdout as it is serialized.
+    With `keep`, the JSON is also returned so it can be passed on to the next stage without serializing it again.
+    """
+    sys.stdout.flush()
+    kept = []
+    for chunk in stream_dump(output):
+        sys.stdout.buffer.write(chunk)
+        if keep:
+            kept.append(chunk)
+    sys.stdout.buffer.flush()
+    return b"".join(kept).decode() if keep else None
+
+
+def merge_analyses(requirements, analyses):
+    """
+    Combines per-requirement analyses into a single AllRequirementsAnalysis.
+    A requirement whose analysis is None (its step timed out) is recorded as not analysed and cannot be satisfied.
+    """
+    items = []
+    for number, (requirement, analysis) in enumerate(zip(requirements, analyses), start=1):
+        if analysis is None:
+            items.append(RequirementAnalysis(
+                requirement_number=number,
+                requirement_specification=requirement,
+                relevant_available_files=[],
+                requirement_satisfied_already=False,
+                possible_to_satisfy_requirement=None,
+                plan_of_action=None,
+                reasoning="Not analysed: the analysis step timed out."
+            ))
+        else:
+            items.extend(analysis.all_requirements_analysis)
+    return AllRequirementsAnalysis(
+        all_requirements_analysis=items,
+        can_satisfy_all_requirements=all(analysis is not None and analysis.can_satisfy_all_requirements for analysis in analyses),
+        any_user_input_required=False,
+        question_to_user=None
+    )
+
+
+async def run_workflow(reader_agent, analyzer_agent, planner_agent, executor_agent, qc_agent):
+    """Runs the Analysis --> Task Planning --> Execution --> Quality Check stages."""
+    # The manifest is the first dynamic message of every stage, directly after each agent's static prefix
+    manifest = manifest_message(await build_asset_manifest())
+    messages = [manifest, stage_message(REQUIREMENTS_PROMPT)]
+
+    # STEP 1: Analysis (each requirement is analysed independently and concurrently)
     print("----- STARTING ANALYSIS -----")
-    result_1 = await process_step(analyzer_agent, messages)
-    output_1 = result_1.final_output.model_dump_json(indent=2)
-    print(output_1)
+    requirements = (await process_step(reader_agent, messages, use_cache=True)).final_output.requirements
+    if not requirements:
+        print("Error: No client requirements were found in ./assets.\nPlease add them to the requirements document and run again.")
+        sys.exit(1)
+    analyzer_results = await process_parallel_steps(analyzer_agent, [
+        [manifest, requirement_message(ANALYZER_PROMPT, number, requirement)]
+        for number, requirement in enumerate(requirements, start=1)
+    ], use_cache=True)
+    analyses = [result.final_output if result is not None else None for result in analyzer_results]
+    output_1 = print_output(merge_analyses(requirements, analyses), keep=True)
 
-    messages = result_1.to_input_list()
-    messages.append({'role': 'user', 'content': PLANNER_PROMPT})
+    messages = [
+        manifest,
+        {'role': 'user', 'content': ANALYZER_PROMPT},
+        {'role': 'assistant', 'content': output_1},
+        stage_message(PLANNER_PROMPT)
+    ]
 
     # STEP 2: Planning
     print("----- STARTING PLANNING -----")
-    result_2 = await process_step(planner_agent, messages)
-    output_2 = result_2.final_output.model_dump_json(indent=2)
-    print(output_2)
+    result_2 = await process_step(planner_agent, messages, use_cache=True)
+    print_output(result_2.final_output)
 
-    messages = result_2.to_input_list()
-    messages.append({'role': 'user', 'content': EXECUTOR_PROMPT})
+    messages = compact_messages(result_2.to_input_list())
+    messages.append(stage_message(EXECUTOR_PROMPT))
 
     # STEP 3: Execution
     print("----- STARTING EXECUTION -----")
     result_3 = await process_step(executor_agent, messages)
-    output_3 = result_3.final_output.model_dump_json(indent=2)
-    print(output_3)
+    print_output(result_3.final_output)
 
-    messages = result_3.to_input_list()
-    messages.append({'role': 'user', 'content': QC_PROMPT})
+    # Rescan so QC sees the generated files; unchanged inputs are not probed again
+    messages = compact_messages(result_3.to_input_list())
+    messages.append(manifest_message(await build_asset_manifest()))
+    messages.append(stage_message(QC_PROMPT))
 
-    # STEP 4: QC
+    # STEP 4: QC (a single agent, since it may rename or clean up files in ./assets)
     print("----- STARTING QUALITY CHECK -----")
     result_4 = await process_step(qc_agent, messages)
-    output_4 = result_4.final_output.model_dump_json(indent=2)
-    print(output_4)
+    print_output(result_4.final_output)
 
     print("----- WORKFLOW COMPLETE -----")
 
 
+async def main():
+    if not os.getenv("GEMINI_API_KEY"):
+        print("Error: GEMINI_API_KEY is not set.\nPlease ensure your GEMINI_API_KEY is set in the .env file.")
+        sys.exit(1)
+
+    # The Gemini SDK, magentic and httpx are only imported once the API key is known to be present
+    import google.generativeai as genai
+    import httpx
+
+    # Configure the Google Gemini API client
+    try:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    except Exception as e:
+        print(f"Error configuring Gemini API: {e}\nPlease ensure your GEMINI_API_KEY is set in the .env file.")
+        sys.exit(1)
+
+    # One HTTP/2 connection pool shared by every agent, so sequential stages reuse connections
+    # and the concurrent per-requirement calls are multiplexed instead of each opening a TLS session
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=0,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=8)
+    )
+    async with httpx.AsyncClient(transport=transport) as shared_http_client:
+        await run_workflow(*build_agents(shared_http_client))
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is a faster drop-in event loop; it is POSIX-only, so fall back to asyncio's default loop elsewhere
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        if sys.version_info >= (3, 12):
+            # asyncio.run() takes a loop factory from Python 3.12, where uvloop.install() and the policy API it uses are deprecated
+            asyncio.run(main(), loop_factory=uvloop.new_event_loop)
+        else:
+            uvloop.install()
+            asyncio.run(main())
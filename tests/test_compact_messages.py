@@ -0,0 +1,42 @@
+import unittest
+
+from main import COMPACTED_OUTPUT_PREFIX, compact_messages
+
+
+def tool_round(call_id, output):
+    return [
+        {"type": "function_call", "call_id": call_id, "name": "execute_terminal_commands", "arguments": '{"commands": ["ls"]}'},
+        {"type": "function_call_output", "call_id": call_id, "output": output}
+    ]
+
+
+def tool_outputs(messages):
+    return [item["output"] for item in messages if item.get("type") == "function_call_output"]
+
+
+class CompactMessagesTest(unittest.TestCase):
+    def test_fewer_outputs_than_kept_are_left_untouched(self):
+        messages = [{"role": "user", "content": "hi"}] + tool_round("a", "first") + tool_round("b", "second")
+        self.assertEqual(compact_messages(messages, keep_last_n_tool_calls=3), messages)
+
+    def test_only_older_outputs_are_compacted(self):
+        messages = tool_round("a", "first") + tool_round("b", "second") + tool_round("c", "third")
+        outputs = tool_outputs(compact_messages(messages, keep_last_n_tool_calls=2))
+        self.assertTrue(outputs[0].startswith(COMPACTED_OUTPUT_PREFIX))
+        self.assertEqual(outputs[1:], ["second", "third"])
+
+    def test_keeping_zero_compacts_every_output(self):
+        messages = tool_round("a", "first") + tool_round("b", "second")
+        outputs = tool_outputs(compact_messages(messages, keep_last_n_tool_calls=0))
+        self.assertTrue(all(output.startswith(COMPACTED_OUTPUT_PREFIX) for output in outputs))
+
+    def test_calls_and_other_messages_are_kept_in_place(self):
+        messages = [{"role": "user", "content": "hi"}] + tool_round("a", "first") + tool_round("b", "second")
+        compacted = compact_messages(messages, keep_last_n_tool_calls=1)
+        self.assertEqual(len(compacted), len(messages))
+        self.assertEqual([item for item in compacted if item.get("type") != "function_call_output"],
+                         [item for item in messages if item.get("type") != "function_call_output"])
+
+
+if __name__ == "__main__":
+    unittest.main()
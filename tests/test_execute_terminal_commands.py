@@ -0,0 +1,56 @@
+import asyncio
+import os
+import re
+import unittest
+
+import orjson
+
+from main import _split_on_boundaries, execute_terminal_commands
+
+MARKER = "---CMD_BOUNDARY_test_"
+PATTERN = re.escape(MARKER) + r"(\d+):(-?\d*)\n"
+
+
+class SplitOnBoundariesTest(unittest.TestCase):
+    def test_output_is_split_per_command(self):
+        text = f"a\n{MARKER}0:0\nb\n{MARKER}1:2\n"
+        self.assertEqual(_split_on_boundaries(text, PATTERN), ({0: ("a\n", "0"), 1: ("b\n", "2")}, ""))
+
+    def test_output_after_the_last_marker_is_returned(self):
+        text = f"a\n{MARKER}0:0\nsyntax error\n"
+        self.assertEqual(_split_on_boundaries(text, PATTERN), ({0: ("a\n", "0")}, "syntax error\n"))
+
+    def test_output_without_markers_is_all_trailing(self):
+        self.assertEqual(_split_on_boundaries("no markers\n", PATTERN), ({}, "no markers\n"))
+
+    def test_stderr_markers_carry_no_return_code(self):
+        self.assertEqual(_split_on_boundaries(f"warning\n{MARKER}0:\n", PATTERN), ({0: ("warning\n", "")}, ""))
+
+
+@unittest.skipUnless(os.name == "posix", "batched commands need a POSIX shell")
+class ExecuteTerminalCommandsTest(unittest.TestCase):
+    def run_batch(self, commands, stop_on_error=True):
+        return orjson.loads(asyncio.run(execute_terminal_commands(commands, stop_on_error)))
+
+    def test_commands_are_reported_in_order(self):
+        output = self.run_batch(["echo a", "echo b"])
+        self.assertEqual([(item["stdout"], item["return_code"]) for item in output["results"]], [("a\n", 0), ("b\n", 0)])
+
+    def test_stop_on_error_skips_later_commands(self):
+        output = self.run_batch(["echo a", "false", "echo b"])
+        self.assertEqual([item["command"] for item in output["results"]], ["echo a", "false"])
+        self.assertEqual(output["results"][-1]["return_code"], 1)
+
+    def test_exit_is_reported_with_the_shell_return_code(self):
+        output = self.run_batch(["exit 3", "echo next"])
+        self.assertEqual(output["results"], [{"command": "exit 3", "stdout": "", "stderr": "", "return_code": 3}])
+
+    def test_syntax_error_output_is_kept(self):
+        output = self.run_batch(['echo "unterminated', "echo next"])
+        self.assertEqual(len(output["results"]), 1)
+        self.assertTrue(output["results"][0]["stderr"])
+        self.assertNotEqual(output["results"][0]["return_code"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()